@@ -1,5 +1,6 @@
 """Probability distributions."""
 
+import math
 from abc import ABC, abstractmethod
 from typing import Any, Dict, List, Optional, Tuple, Union
 
@@ -9,11 +10,18 @@ import torch as th
 from gym import spaces
 from torch import nn
 from torch.distributions import Bernoulli, Categorical, Normal
+from torch.nn import functional as F
 
 from stable_baselines3.common.preprocessing import get_action_dim
 
-import traceback
-import sys
+# Constants of the closed forms below. Python floats are passed to the kernels
+# as arguments, so they do not need to be stored as tensors on each device.
+_LOG_SQRT_2PI = 0.5 * math.log(2 * math.pi)
+_LOG_2 = math.log(2.0)
+# Entropy of a standard normal distribution
+_STD_NORMAL_ENTROPY = 0.5 + _LOG_SQRT_2PI
+# Clipping bounds used to invert tanh, per dtype
+_TANH_INVERSE_BOUNDS: Dict[th.dtype, Tuple[float, float]] = {}
 
 
 class Distribution(ABC):
@@ -118,6 +126,67 @@ def sum_independent_dims(tensor: th.Tensor) -> th.Tensor:
     return tensor
 
 
+def gaussian_log_prob(actions: th.Tensor, mean: th.Tensor, std: th.Tensor) -> th.Tensor:
+    """
+    Log likelihood of each action component under a Gaussian distribution,
+    in closed form so that it can be summed in the same pass.
+
+    :param actions: shape: (n_batch, n_actions)
+    :param mean: shape: (n_batch, n_actions)
+    :param std: Standard deviation, broadcastable to ``mean``
+    :return: shape: (n_batch, n_actions)
+    """
+    return -0.5 * ((actions - mean) / std) ** 2 - th.log(std) - _LOG_SQRT_2PI
+
+
+def gaussian_entropy(std: th.Tensor) -> th.Tensor:
+    """
+    Entropy of each component of a Gaussian distribution.
+
+    :param std: Standard deviation, shape: (n_batch, n_actions)
+    :return: shape: (n_batch, n_actions)
+    """
+    return _STD_NORMAL_ENTROPY + th.log(std)
+
+
+def categorical_entropy(
+    logits: th.Tensor, max_chunk_numel: int = int(1e7)
+) -> th.Tensor:
+    """
+    Entropy of categorical distributions given their logits.
+    Large batches are processed in chunks to bound the size
+    of the intermediate probability tensors.
+
+    :param logits: shape: (n_batch, ..., n_categories)
+    :param max_chunk_numel: Maximum number of logits processed at once
+    :return: shape: (n_batch, ...)
+    """
+
+    def entropy(chunk: th.Tensor) -> th.Tensor:
+        log_p = F.log_softmax(chunk, dim=-1)
+        # Avoid NaN (0 * -inf) for categories with zero probability
+        log_p = log_p.clamp(min=th.finfo(log_p.dtype).min)
+        return -(log_p.exp() * log_p).sum(dim=-1)
+
+    if logits.dim() < 2 or logits.numel() <= max_chunk_numel:
+        return entropy(logits)
+    chunk_size = max(1, max_chunk_numel // logits[0].numel())
+    return th.cat([entropy(chunk) for chunk in logits.split(chunk_size)], dim=0)
+
+
+def sample_gumbel_max(logits: th.Tensor) -> th.Tensor:
+    """
+    Sample from categorical distributions using the Gumbel-max trick:
+    argmax(logits + Gumbel noise). The logits do not need to be normalized.
+
+    :param logits: shape: (n_batch, ..., n_categories)
+    :return: shape: (n_batch, ...)
+    """
+    # Avoid log(0)
+    uniform = th.rand_like(logits).clamp_min_(th.finfo(logits.dtype).tiny)
+    return th.argmax(logits - th.log(-th.log(uniform)), dim=-1)
+
+
 class DiagGaussianDistribution(Distribution):
     """
     Gaussian distribution with diagonal covariance matrix, for continuous actions.
@@ -130,6 +199,8 @@ class DiagGaussianDistribution(Distribution):
         self.action_dim = action_dim
         self.mean_actions = None
         self.log_std = None
+        # std before broadcasting to the batch, usually of shape (n_actions,)
+        self._action_std = None
 
     def proba_distribution_net(
         self, latent_dim: int, log_std_init: float = 0.0
@@ -160,8 +231,11 @@ class DiagGaussianDistribution(Distribution):
         :param log_std:
         :return:
         """
-        action_std = th.ones_like(mean_actions) * log_std.exp()
-        self.distribution = Normal(mean_actions, action_std)
+        # Normal broadcasts the std over the batch dimension, no need to expand it
+        action_std = log_std.exp()
+        self._action_std = action_std
+        # Skip the argument checks, they synchronize with the device on every call
+        self.distribution = Normal(mean_actions, action_std, validate_args=False)
         return self
 
     def log_prob(self, actions: th.Tensor) -> th.Tensor:
@@ -172,11 +246,15 @@ class DiagGaussianDistribution(Distribution):
         :param actions:
         :return:
         """
-        log_prob = self.distribution.log_prob(actions)
+        # The unbroadcast std keeps its log from running over the whole batch
+        log_prob = gaussian_log_prob(actions, self.distribution.loc, self._action_std)
         return sum_independent_dims(log_prob)
 
     def entropy(self) -> th.Tensor:
-        return sum_independent_dims(self.distribution.entropy())
+        # Sum along action dim before broadcasting to the batch,
+        # the copy gives callers a regular (n_batch,) tensor they can modify in place
+        entropy = th.sum(gaussian_entropy(self._action_std), dim=-1)
+        return entropy.expand(self.distribution.batch_shape[:-1]).clone()
 
     def sample(self) -> th.Tensor:
         # Reparametrization trick to pass gradients
@@ -213,12 +291,12 @@ class SquashedDiagGaussianDistribution(DiagGaussianDistribution):
     Gaussian distribution with diagonal covariance matrix, followed by a squashing function (tanh) to ensure bounds.
 
     :param action_dim: Dimension of the action space.
-    :param epsilon: small value to avoid NaN due to numerical imprecision.
+    :param epsilon: Unused, kept for backward compatibility:
+        the squash correction is computed in a stable form that does not need it.
     """
 
     def __init__(self, action_dim: int, epsilon: float = 1e-6):
         super().__init__(action_dim)
-        # Avoid NaN (prevents division by zero or log of zero)
         self.epsilon = epsilon
         self.gaussian_actions = None
 
@@ -233,17 +311,19 @@ class SquashedDiagGaussianDistribution(DiagGaussianDistribution):
     ) -> th.Tensor:
         # Inverse tanh
         # Naive implementation (not stable): 0.5 * torch.log((1 + x) / (1 - x))
-        # We use numpy to avoid numerical instability
         if gaussian_actions is None:
             # It will be clipped to avoid NaN when inversing tanh
             gaussian_actions = TanhBijector.inverse(actions)
 
         # Log likelihood for a Gaussian distribution
-        log_prob = super().log_prob(gaussian_actions)
+        log_prob = gaussian_log_prob(
+            gaussian_actions, self.distribution.loc, self._action_std
+        )
         # Squash correction (from original SAC implementation)
         # this comes from the fact that tanh is bijective and differentiable
-        log_prob -= th.sum(th.log(1 - actions ** 2 + self.epsilon), dim=1)
-        return log_prob
+        log_prob -= TanhBijector.log_prob_correction(gaussian_actions)
+        # Sum along action dim
+        return log_prob.sum(dim=1)
 
     def entropy(self) -> Optional[th.Tensor]:
         # No analytical form,
@@ -268,7 +348,49 @@ class SquashedDiagGaussianDistribution(DiagGaussianDistribution):
         return action, log_prob
 
 
-class CategoricalDistribution(Distribution):
+class _LazyCategoricalDistribution(Distribution):
+    """
+    Base class for the categorical distributions over a single action,
+    defined by their logits. The ``Categorical`` object (which normalizes the logits)
+    is only built when it is needed: sampling, the mode and the entropy use the logits directly.
+    """
+
+    @property
+    def distribution(self) -> Optional[Categorical]:
+        if self._distribution is None and self._action_logits is not None:
+            self._distribution = Categorical(
+                logits=self._action_logits, validate_args=False
+            )
+        return self._distribution
+
+    @distribution.setter
+    def distribution(self, distribution: Optional[Categorical]) -> None:
+        self._distribution = distribution
+        self._action_logits = None if distribution is None else distribution.logits
+
+    def _set_action_logits(self, action_logits: th.Tensor) -> None:
+        """
+        Set the parameters of the distribution.
+
+        :param action_logits: shape: (n_batch, action_dim)
+        """
+        self._distribution = None
+        self._action_logits = action_logits
+
+    def log_prob(self, actions: th.Tensor) -> th.Tensor:
+        return self.distribution.log_prob(actions)
+
+    def entropy(self) -> th.Tensor:
+        return categorical_entropy(self._action_logits)
+
+    def sample(self) -> th.Tensor:
+        return sample_gumbel_max(self._action_logits)
+
+    def mode(self) -> th.Tensor:
+        return th.argmax(self._action_logits, dim=1)
+
+
+class CategoricalDistribution(_LazyCategoricalDistribution):
     """
     Categorical distribution for discrete actions.
 
@@ -278,8 +400,6 @@ class CategoricalDistribution(Distribution):
     def __init__(self, action_dim: int):
         super().__init__()
         self.action_dim = action_dim
-        print("In CategoricalDistribution constructor")
-        raise Exception("In CategoricalDistribution")
 
     def proba_distribution_net(self, latent_dim: int) -> nn.Module:
         """
@@ -295,21 +415,9 @@ class CategoricalDistribution(Distribution):
         return action_logits
 
     def proba_distribution(self, action_logits: th.Tensor) -> "CategoricalDistribution":
-        self.distribution = Categorical(logits=action_logits)
+        self._set_action_logits(action_logits)
         return self
 
-    def log_prob(self, actions: th.Tensor) -> th.Tensor:
-        return self.distribution.log_prob(actions)
-
-    def entropy(self) -> th.Tensor:
-        return self.distribution.entropy()
-
-    def sample(self) -> th.Tensor:
-        return self.distribution.sample()
-
-    def mode(self) -> th.Tensor:
-        return th.argmax(self.distribution.probs, dim=1)
-
     def actions_from_params(
         self, action_logits: th.Tensor, deterministic: bool = False
     ) -> th.Tensor:
@@ -325,7 +433,7 @@ class CategoricalDistribution(Distribution):
         return actions, log_prob
 
 
-class CategoricalDistributionLimitedActions(Distribution):
+class CategoricalDistributionLimitedActions(_LazyCategoricalDistribution):
     """
     Categorical distribution for discrete actions where the valid actions are a subset of the total action space.
 
@@ -342,11 +450,8 @@ class CategoricalDistributionLimitedActions(Distribution):
         self._get_invalid_actions_layer = get_invalid_actions_layer_obj()
         self._get_invalid_actions_obj = get_invalid_actions_layer_obj
         self._original_action_logits = None
-        self._valid_actions = None
         self._invalid_actions = None
 
-        print("In CategoricalDistributionLimitedActions constructor")
-
     def proba_distribution_net(self, latent_dim: int) -> nn.Module:
         """
         Create the layer that represents the distribution:
@@ -373,85 +478,20 @@ class CategoricalDistributionLimitedActions(Distribution):
 
         self._original_action_logits = action_logits
         self._invalid_actions = invalid_actions
-        if False:
-            self._valid_actions = self._get_invalid_actions_obj.get_valid_actions(obs)
 
         # TODO: Figure out how to set the invalid action minimum on a per-action basis.
-        if False:
-            print("")
-            print("----------------------------")
-            print("")
-            print("action_logits", action_logits)
-            print("action_logits len", len(action_logits))
-            mint = action_logits.min(1, keepdim=True)
-            print("mint true", mint)
-            print("mint true len", len(mint.values))
-            # mint = action_logits.min(1, keepdim=False)
-            # print("mint false", mint)
-
-            print("invalid", invalid_actions)
-            test_new_action_logits = action_logits.clone()
-            test_new_action_logits[invalid_actions] = mint.values
-            print(test_new_action_logits)
-
         # Create a distribution to use when sampling.
         # Adjust the logits so that the invalid actions have small probabilities.
-        invalid_logit_value = action_logits.min() - 10.0
-        if invalid_logit_value >= -10.0:
-            invalid_logit_value = -10.0
+        invalid_logit_value = (action_logits.min() - 10.0).clamp_max(-10.0)
 
-        new_action_logits = action_logits.clone()
-        new_action_logits[invalid_actions] = invalid_logit_value
+        new_action_logits = action_logits.masked_fill(
+            invalid_actions, invalid_logit_value
+        )
 
         self._invalid_logit_value = invalid_logit_value
-        self._new_action_logits = new_action_logits
-
-        if False:
-            print("")
-            print("----------------------------")
-            print("")
-            print("action_logits", action_logits)
-            print("new_action_logits", new_action_logits)
-            print("invalid_actions", invalid_actions)
-            print("obs", obs)
-            print("invalid_logit_value", invalid_logit_value)
-            # traceback.print_stack(file=sys.stdout)
-
-        self.distribution = Categorical(logits=new_action_logits)
+        self._set_action_logits(new_action_logits)
         return self
 
-    def log_prob(self, actions: th.Tensor) -> th.Tensor:
-        return self.distribution.log_prob(actions)
-
-    def entropy(self) -> th.Tensor:
-        return self.distribution.entropy()
-
-    def sample(self) -> th.Tensor:
-        ret = self.distribution.sample()
-
-        if False:
-            print(self.distribution)
-            print(self.distribution.logits)
-            print(self.sample_distribution)
-            print(self.sample_distribution.logits)
-            print("Sample", ret)
-
-        if False and self.distribution.logits[0][ret] < -9.5:
-            print("Invalid action")
-            print(self.distribution)
-            print(self.distribution.logits)
-            print("Invalid_logit_value", self._invalid_logit_value)
-            print("original_action_logits", self._original_action_logits)
-            print("new_action_logits", self._new_action_logits)
-            print("invalid_actions", self._invalid_actions)
-            print("valid_actions", self._valid_actions)
-            print("Sample", ret)
-
-        return ret
-
-    def mode(self) -> th.Tensor:
-        return th.argmax(self.distribution.probs, dim=1)
-
     def actions_from_params(
         self, action_logits: th.Tensor, get_valid_actions, deterministic: bool = False
     ) -> th.Tensor:
@@ -472,17 +512,28 @@ class CategoricalDistributionLimitedActions_Manual(Distribution):
     Categorical distribution for discrete actions where the valid actions are a subset of the total action space.
 
     :param action_dim: Number of discrete actions
+    :param get_valid_actions: Function taking a batch of observations and returning
+        a tensor of shape (n_batch, action_dim) that is zero for the invalid actions.
+    :param vectorize_valid_actions: Whether ``get_valid_actions`` takes a single observation
+        instead of a batch. It is then vectorized over the batch with ``torch.vmap``
+        (requires PyTorch >= 2.0), so it must only use PyTorch operations.
     """
 
-    def __init__(self, action_dim: int, get_valid_actions):
+    def __init__(
+        self,
+        action_dim: int,
+        get_valid_actions,
+        vectorize_valid_actions: bool = False,
+    ):
         super().__init__()
         self.action_dim = action_dim
-        self._get_valid_actions = get_valid_actions
 
         if get_valid_actions is None:
             raise Exception("get_valid_actions is none")
 
-        print("In CategoricalDistributionLimitedActions constructor")
+        if vectorize_valid_actions:
+            get_valid_actions = th.vmap(get_valid_actions)
+        self._get_valid_actions = get_valid_actions
 
     def proba_distribution_net(self, latent_dim: int) -> nn.Module:
         """
@@ -505,67 +556,34 @@ class CategoricalDistributionLimitedActions_Manual(Distribution):
         if obs is None:
             raise Exception("In get_valid_actions the observation is None")
 
-        self.distribution = Categorical(logits=action_logits)
+        self.distribution = Categorical(logits=action_logits, validate_args=False)
 
         # Create a distribution to use when sampling.
         # Adjust the logits so that the invalid actions have small probabilities.
-        invalid_logit_value = action_logits.min() - 100.0
-        if invalid_logit_value >= -100.0:
-            invalid_logit_value = -100.0
-
-        valid_actions_list = []
-        for obs_index in range(len(obs)):
-            valid_actions = self._get_valid_actions(obs[obs_index])
-            valid_actions_list.append(valid_actions)
+        invalid_logit_value = (action_logits.min() - 100.0).clamp_max(-100.0)
 
-        all_valid_actions = th.stack(valid_actions_list)
+        all_valid_actions = self._get_valid_actions(obs)
 
-        new_action_logits = th.where(
-            all_valid_actions == 0, invalid_logit_value, action_logits
+        new_action_logits = action_logits.masked_fill(
+            all_valid_actions == 0, invalid_logit_value
         )
 
-        if True:
-            print("")
-            print("----------------------------")
-            print("")
-            print("action_logits", action_logits)
-            print("new_action_logits", new_action_logits)
-            print("obs", obs)
-            print("all_valid_actions", all_valid_actions)
-            print("invalid_logit_value", invalid_logit_value)
-            # traceback.print_stack(file=sys.stdout)
-
-        self.sample_distribution = Categorical(logits=new_action_logits)
+        self.sample_distribution = Categorical(
+            logits=new_action_logits, validate_args=False
+        )
         return self
 
     def log_prob(self, actions: th.Tensor) -> th.Tensor:
         return self.distribution.log_prob(actions)
 
     def entropy(self) -> th.Tensor:
-        return self.distribution.entropy()
+        return categorical_entropy(self.distribution.logits)
 
     def sample(self) -> th.Tensor:
-        ret = self.sample_distribution.sample()
-
-        if False:
-            print(self.distribution)
-            print(self.distribution.logits)
-            print(self.sample_distribution)
-            print(self.sample_distribution.logits)
-            print("Sample", ret)
-
-        if True and self.sample_distribution.logits[0][ret] < -9.5:
-            print("Invalid action")
-            print(self.distribution)
-            print(self.distribution.logits)
-            print(self.sample_distribution)
-            print(self.sample_distribution.logits)
-            print("Sample", ret)
-
-        return ret
+        return self.sample_distribution.sample()
 
     def mode(self) -> th.Tensor:
-        return th.argmax(self.sample_distribution.probs, dim=1)
+        return th.argmax(self.sample_distribution.logits, dim=1)
 
     def actions_from_params(
         self, action_logits: th.Tensor, get_valid_actions, deterministic: bool = False
@@ -592,6 +610,17 @@ class MultiCategoricalDistribution(Distribution):
     def __init__(self, action_dims: List[int]):
         super().__init__()
         self.action_dims = action_dims
+        # The flattened logits are rearranged into a single tensor of shape
+        # (n_batch, n_sub_spaces, max_dim) so that one Categorical handles all
+        # the sub-spaces. The logits missing in the smaller sub-spaces point to
+        # an extra column holding the lowest finite value
+        # (zero probability, but no NaN in the gradients).
+        dims = [int(dim) for dim in action_dims]
+        self._pad_index = th.full((len(dims), max(dims)), sum(dims), dtype=th.long)
+        offset = 0
+        for i, dim in enumerate(dims):
+            self._pad_index[i, :dim] = th.arange(offset, offset + dim)
+            offset += dim
 
     def proba_distribution_net(self, latent_dim: int) -> nn.Module:
         """
@@ -610,34 +639,28 @@ class MultiCategoricalDistribution(Distribution):
     def proba_distribution(
         self, action_logits: th.Tensor
     ) -> "MultiCategoricalDistribution":
-        self.distribution = [
-            Categorical(logits=split)
-            for split in th.split(action_logits, tuple(self.action_dims), dim=1)
-        ]
+        if self._pad_index.device != action_logits.device:
+            self._pad_index = self._pad_index.to(action_logits.device)
+        padding = action_logits.new_full(
+            action_logits.shape[:-1] + (1,), th.finfo(action_logits.dtype).min
+        )
+        padded_logits = th.cat([action_logits, padding], dim=-1)[..., self._pad_index]
+        # One categorical per sub-space: batch shape is (n_batch, n_sub_spaces)
+        self.distribution = Categorical(logits=padded_logits, validate_args=False)
         return self
 
     def log_prob(self, actions: th.Tensor) -> th.Tensor:
-        # Extract each discrete action and compute log prob for their respective distributions
-        return th.stack(
-            [
-                dist.log_prob(action)
-                for dist, action in zip(self.distribution, th.unbind(actions, dim=1))
-            ],
-            dim=1,
-        ).sum(dim=1)
+        # Each discrete action is evaluated by the distribution of its sub-space
+        return self.distribution.log_prob(actions).sum(dim=1)
 
     def entropy(self) -> th.Tensor:
-        return th.stack([dist.entropy() for dist in self.distribution], dim=1).sum(
-            dim=1
-        )
+        return categorical_entropy(self.distribution.logits).sum(dim=1)
 
     def sample(self) -> th.Tensor:
-        return th.stack([dist.sample() for dist in self.distribution], dim=1)
+        return self.distribution.sample()
 
     def mode(self) -> th.Tensor:
-        return th.stack(
-            [th.argmax(dist.probs, dim=1) for dist in self.distribution], dim=1
-        )
+        return th.argmax(self.distribution.logits, dim=-1)
 
     def actions_from_params(
         self, action_logits: th.Tensor, deterministic: bool = False
@@ -678,7 +701,7 @@ class BernoulliDistribution(Distribution):
         return action_logits
 
     def proba_distribution(self, action_logits: th.Tensor) -> "BernoulliDistribution":
-        self.distribution = Bernoulli(logits=action_logits)
+        self.distribution = Bernoulli(logits=action_logits, validate_args=False)
         return self
 
     def log_prob(self, actions: th.Tensor) -> th.Tensor:
@@ -691,7 +714,8 @@ class BernoulliDistribution(Distribution):
         return self.distribution.sample()
 
     def mode(self) -> th.Tensor:
-        return th.round(self.distribution.probs)
+        # Same as rounding the probabilities, without computing them
+        return (self.distribution.logits > 0).to(self.distribution.logits.dtype)
 
     def actions_from_params(
         self, action_logits: th.Tensor, deterministic: bool = False
@@ -728,6 +752,9 @@ class StateDependentNoiseDistribution(Distribution):
         This will enable gradients to be backpropagated through the features
         ``latent_sde`` in the code.
     :param epsilon: small value to avoid NaN due to numerical imprecision.
+    :param use_bf16: Whether to store the exploration matrices and compute the noise
+        and the variance in bfloat16 (the ``log_std`` parameter stays in full precision).
+        It halves the memory traffic of these operations on hardware with fast bfloat16 support.
     """
 
     def __init__(
@@ -738,24 +765,32 @@ class StateDependentNoiseDistribution(Distribution):
         squash_output: bool = False,
         learn_features: bool = False,
         epsilon: float = 1e-6,
+        use_bf16: bool = False,
     ):
         super().__init__()
         self.action_dim = action_dim
         self.latent_sde_dim = None
         self.mean_actions = None
         self.log_std = None
-        self.weights_dist = None
         self.exploration_mat = None
         self.exploration_matrices = None
         self._latent_sde = None
+        # Number of exploration matrices, i.e. the first dimension of exploration_matrices
+        self._n_exploration_matrices = 0
+        # Actions before squashing of the last call to sample() or mode()
+        self.gaussian_actions = None
         self.use_expln = use_expln
         self.full_std = full_std
         self.epsilon = epsilon
         self.learn_features = learn_features
+        self.use_bf16 = use_bf16
+        # Transformation applied to the gaussian actions by sample() and mode()
         if squash_output:
             self.bijector = TanhBijector(epsilon)
+            self._post_transform = self.bijector.forward
         else:
             self.bijector = None
+            self._post_transform = _identity
 
     def get_std(self, log_std: th.Tensor) -> th.Tensor:
         """
@@ -768,11 +803,12 @@ class StateDependentNoiseDistribution(Distribution):
         if self.use_expln:
             # From gSDE paper, it allows to keep variance
             # above zero and prevent it from growing too fast
-            below_threshold = th.exp(log_std) * (log_std <= 0)
-            # Avoid NaN: zeros values that are below zero
-            safe_log_std = log_std * (log_std > 0) + self.epsilon
-            above_threshold = (th.log1p(safe_log_std) + 1.0) * (log_std > 0)
-            std = below_threshold + above_threshold
+            # Avoid NaN: the log1p() operand is clamped where it is not used
+            std = th.where(
+                log_std <= 0,
+                th.exp(log_std),
+                th.log1p(log_std.clamp(min=0.0) + self.epsilon) + 1.0,
+            )
         else:
             # Use normal exponential
             std = th.exp(log_std)
@@ -780,7 +816,8 @@ class StateDependentNoiseDistribution(Distribution):
         if self.full_std:
             return std
         # Reduce the number of parameters:
-        return th.ones(self.latent_sde_dim, self.action_dim).to(log_std.device) * std
+        # broadcast the (latent_sde_dim, 1) std to all actions without a copy
+        return std.expand(self.latent_sde_dim, self.action_dim)
 
     def sample_weights(self, log_std: th.Tensor, batch_size: int = 1) -> None:
         """
@@ -791,11 +828,32 @@ class StateDependentNoiseDistribution(Distribution):
         :param batch_size:
         """
         std = self.get_std(log_std)
-        self.weights_dist = Normal(th.zeros_like(std), std)
+        if self.use_bf16:
+            # The noise is sampled in low precision, gradients still flow to log_std
+            std = std.to(th.bfloat16)
         # Reparametrization trick to pass gradients
-        self.exploration_mat = self.weights_dist.rsample()
+        self.exploration_mat = std * th.randn_like(std)
         # Pre-compute matrices in case of parallel exploration
-        self.exploration_matrices = self.weights_dist.rsample((batch_size,))
+        shape = (batch_size,) + std.shape
+        self._n_exploration_matrices = batch_size
+        if th.is_grad_enabled() and std.requires_grad:
+            self.exploration_matrices = std * th.randn(
+                shape, dtype=std.dtype, device=std.device
+            )
+            return
+        # No gradient needed (e.g. when collecting rollouts):
+        # sample the new matrices in place of the previous ones
+        if (
+            self.exploration_matrices is None
+            or self.exploration_matrices.requires_grad
+            or self.exploration_matrices.shape != shape
+            or self.exploration_matrices.dtype != std.dtype
+            or self.exploration_matrices.device != std.device
+        ):
+            self.exploration_matrices = th.empty(
+                shape, dtype=std.dtype, device=std.device
+            )
+        self.exploration_matrices.normal_().mul_(std)
 
     def proba_distribution_net(
         self,
@@ -844,58 +902,67 @@ class StateDependentNoiseDistribution(Distribution):
         """
         # Stop gradient if we don't want to influence the features
         self._latent_sde = latent_sde if self.learn_features else latent_sde.detach()
-        variance = th.mm(self._latent_sde ** 2, self.get_std(log_std) ** 2)
-        self.distribution = Normal(mean_actions, th.sqrt(variance + self.epsilon))
+        std_sq = self.get_std(log_std) ** 2
+        if self.use_bf16:
+            # Low precision matrix product, epsilon is added in full precision
+            variance = th.mm(
+                self._latent_sde.to(th.bfloat16) ** 2, std_sq.to(th.bfloat16)
+            ).to(std_sq.dtype)
+        else:
+            variance = th.mm(self._latent_sde ** 2, std_sq)
+        # The matrix product result is a fresh tensor, epsilon can be added in place
+        variance.add_(self.epsilon)
+        self.distribution = Normal(mean_actions, th.sqrt(variance), validate_args=False)
         return self
 
-    def log_prob(self, actions: th.Tensor) -> th.Tensor:
-        if self.bijector is not None:
-            gaussian_actions = self.bijector.inverse(actions)
-        else:
-            gaussian_actions = actions
-        # log likelihood for a gaussian
-        log_prob = self.distribution.log_prob(gaussian_actions)
-        # Sum along action dim
-        log_prob = sum_independent_dims(log_prob)
+    def log_prob(
+        self, actions: th.Tensor, gaussian_actions: Optional[th.Tensor] = None
+    ) -> th.Tensor:
+        mean, std = self.distribution.loc, self.distribution.scale
+        if self.bijector is None:
+            # log likelihood for a gaussian, summed along action dim
+            return sum_independent_dims(gaussian_log_prob(actions, mean, std))
 
-        if self.bijector is not None:
-            # Squash correction (from original SAC implementation)
-            log_prob -= th.sum(
-                self.bijector.log_prob_correction(gaussian_actions), dim=1
-            )
-        return log_prob
+        if gaussian_actions is None:
+            # It will be clipped to avoid NaN when inversing tanh
+            gaussian_actions = self.bijector.inverse(actions)
+        # Gaussian log likelihood minus the squash correction
+        # (from original SAC implementation), reduced in a single sum
+        log_prob = gaussian_log_prob(gaussian_actions, mean, std)
+        log_prob -= self.bijector.log_prob_correction(gaussian_actions)
+        return th.sum(log_prob, dim=1)
 
     def entropy(self) -> Optional[th.Tensor]:
         if self.bijector is not None:
             # No analytical form,
             # entropy needs to be estimated using -log_prob.mean()
             return None
-        return sum_independent_dims(self.distribution.entropy())
+        # Constant part summed once over the action dim
+        log_std = th.log(self.distribution.scale)
+        return th.sum(log_std, dim=1) + self.action_dim * _STD_NORMAL_ENTROPY
 
     def sample(self) -> th.Tensor:
         noise = self.get_noise(self._latent_sde)
-        actions = self.distribution.mean + noise
-        if self.bijector is not None:
-            return self.bijector.forward(actions)
-        return actions
+        self.gaussian_actions = self.distribution.mean + noise
+        return self._post_transform(self.gaussian_actions)
 
     def mode(self) -> th.Tensor:
-        actions = self.distribution.mean
-        if self.bijector is not None:
-            return self.bijector.forward(actions)
-        return actions
+        self.gaussian_actions = self.distribution.mean
+        return self._post_transform(self.gaussian_actions)
 
     def get_noise(self, latent_sde: th.Tensor) -> th.Tensor:
         latent_sde = latent_sde if self.learn_features else latent_sde.detach()
+        # The noise is computed with the precision of the exploration matrices
+        dtype = latent_sde.dtype
+        latent_sde = latent_sde.to(self.exploration_mat.dtype)
         # Default case: only one exploration matrix
-        if len(latent_sde) == 1 or len(latent_sde) != len(self.exploration_matrices):
-            return th.mm(latent_sde, self.exploration_mat)
-        # Use batch matrix multiplication for efficient computation
-        # (batch_size, n_features) -> (batch_size, 1, n_features)
-        latent_sde = latent_sde.unsqueeze(dim=1)
-        # (batch_size, 1, n_actions)
-        noise = th.bmm(latent_sde, self.exploration_matrices)
-        return noise.squeeze(dim=1)
+        n_samples = latent_sde.shape[0]
+        if n_samples == 1 or n_samples != self._n_exploration_matrices:
+            return th.mm(latent_sde, self.exploration_mat).to(dtype)
+        # One exploration matrix per sample, (batch_size, n_features)
+        # x (batch_size, n_features, n_actions) -> (batch_size, n_actions)
+        noise = th.einsum("bi,bij->bj", latent_sde, self.exploration_matrices)
+        return noise.to(dtype)
 
     def actions_from_params(
         self,
@@ -912,17 +979,23 @@ class StateDependentNoiseDistribution(Distribution):
         self, mean_actions: th.Tensor, log_std: th.Tensor, latent_sde: th.Tensor
     ) -> Tuple[th.Tensor, th.Tensor]:
         actions = self.actions_from_params(mean_actions, log_std, latent_sde)
-        log_prob = self.log_prob(actions)
+        # The actions before squashing are known, no need to invert the tanh
+        log_prob = self.log_prob(actions, self.gaussian_actions)
         return actions, log_prob
 
 
+def _identity(x: th.Tensor) -> th.Tensor:
+    return x
+
+
 class TanhBijector:
     """
     Bijective transformation of a probability distribution
     using a squashing function (tanh)
     TODO: use Pyro instead (https://pyro.ai/)
 
-    :param epsilon: small value to avoid NaN due to numerical imprecision.
+    :param epsilon: Unused, kept for backward compatibility:
+        the squash correction is computed in a stable form that does not need it.
     """
 
     def __init__(self, epsilon: float = 1e-6):
@@ -938,10 +1011,10 @@ class TanhBijector:
         """
         Inverse of Tanh
 
-        Taken from Pyro: https://github.com/pyro-ppl/pyro
-        0.5 * torch.log((1 + x ) / (1 - x))
+        0.5 * torch.log((1 + x ) / (1 - x)),
+        computed by a single (numerically stable) PyTorch kernel
         """
-        return 0.5 * (x.log1p() - (-x).log1p())
+        return th.atanh(x)
 
     @staticmethod
     def inverse(y: th.Tensor) -> th.Tensor:
@@ -951,13 +1024,68 @@ class TanhBijector:
         :param y:
         :return:
         """
-        eps = th.finfo(y.dtype).eps
+        bounds = _TANH_INVERSE_BOUNDS.get(y.dtype)
+        if bounds is None:
+            eps = th.finfo(y.dtype).eps
+            bounds = _TANH_INVERSE_BOUNDS.setdefault(y.dtype, (-1.0 + eps, 1.0 - eps))
         # Clip the action to avoid NaN
-        return TanhBijector.atanh(y.clamp(min=-1.0 + eps, max=1.0 - eps))
+        return TanhBijector.atanh(y.clamp(min=bounds[0], max=bounds[1]))
+
+    @staticmethod
+    def log_prob_correction(x: th.Tensor) -> th.Tensor:
+        """
+        Squash correction (from original SAC implementation): log(1 - tanh(x)^2),
+        computed in the numerically stable form 2 * (log(2) - x - softplus(-2x)),
+        which is exact even where 1 - tanh(x)^2 underflows, so no epsilon is needed.
+
+        :param x: the actions before squashing
+        :return:
+        """
+        return 2.0 * (_LOG_2 - x - F.softplus(-2.0 * x))
+
+
+def _make_box_distribution(
+    action_space: spaces.Box, use_sde: bool, dist_kwargs: Dict[str, Any]
+) -> Distribution:
+    cls = StateDependentNoiseDistribution if use_sde else DiagGaussianDistribution
+    return cls(get_action_dim(action_space), **dist_kwargs)
+
+
+def _make_discrete_distribution(
+    action_space: spaces.Discrete, use_sde: bool, dist_kwargs: Dict[str, Any]
+) -> Distribution:
+    get_invalid_actions_layer = dist_kwargs.pop("get_invalid_actions_layer", None)
+    get_valid_actions = dist_kwargs.pop("get_valid_actions", None)
+    if get_invalid_actions_layer is not None:
+        return CategoricalDistributionLimitedActions(
+            action_space.n, get_invalid_actions_layer, **dist_kwargs
+        )
+    elif get_valid_actions is not None:
+        return CategoricalDistributionLimitedActions_Manual(
+            action_space.n, get_valid_actions, **dist_kwargs
+        )
+    return CategoricalDistribution(action_space.n, **dist_kwargs)
 
-    def log_prob_correction(self, x: th.Tensor) -> th.Tensor:
-        # Squash correction (from original SAC implementation)
-        return th.log(1.0 - th.tanh(x) ** 2 + self.epsilon)
+
+def _make_multi_discrete_distribution(
+    action_space: spaces.MultiDiscrete, use_sde: bool, dist_kwargs: Dict[str, Any]
+) -> Distribution:
+    return MultiCategoricalDistribution(action_space.nvec, **dist_kwargs)
+
+
+def _make_multi_binary_distribution(
+    action_space: spaces.MultiBinary, use_sde: bool, dist_kwargs: Dict[str, Any]
+) -> Distribution:
+    return BernoulliDistribution(action_space.n, **dist_kwargs)
+
+
+# Distribution constructor for each type of action space
+_DISTRIBUTION_MAKERS = {
+    spaces.Box: _make_box_distribution,
+    spaces.Discrete: _make_discrete_distribution,
+    spaces.MultiDiscrete: _make_multi_discrete_distribution,
+    spaces.MultiBinary: _make_multi_binary_distribution,
+}
 
 
 def make_proba_distribution(
@@ -974,40 +1102,19 @@ def make_proba_distribution(
     :param dist_kwargs: Keyword arguments to pass to the probability distribution
     :return: the appropriate Distribution object
     """
-    if dist_kwargs is None:
-        dist_kwargs = {}
-
-    use_limited_actions = dist_kwargs.get(
-        "get_valid_actions"
-    ) is not None or dist_kwargs.get("get_invalid_actions_layer")
-
-    if isinstance(action_space, spaces.Box):
-        cls = StateDependentNoiseDistribution if use_sde else DiagGaussianDistribution
-        return cls(get_action_dim(action_space), **dist_kwargs)
-    elif isinstance(action_space, spaces.Discrete) and use_limited_actions:
-        get_invalid_actions_layer = dist_kwargs["get_invalid_actions_layer"]
-        del dist_kwargs["get_invalid_actions_layer"]
-        return CategoricalDistributionLimitedActions(
-            action_space.n, get_invalid_actions_layer, **dist_kwargs
-        )
-    elif isinstance(action_space, spaces.Discrete) and use_limited_actions:
-        get_valid_actions = dist_kwargs["get_valid_actions"]
-        del dist_kwargs["get_valid_actions"]
-        return CategoricalDistributionLimitedActions(
-            action_space.n, get_valid_actions, **dist_kwargs
-        )
-    elif isinstance(action_space, spaces.Discrete):
-        return CategoricalDistribution(action_space.n, **dist_kwargs)
-    elif isinstance(action_space, spaces.MultiDiscrete):
-        return MultiCategoricalDistribution(action_space.nvec, **dist_kwargs)
-    elif isinstance(action_space, spaces.MultiBinary):
-        return BernoulliDistribution(action_space.n, **dist_kwargs)
-    else:
-        raise NotImplementedError(
-            "Error: probability distribution, not implemented for action space"
-            f"of type {type(action_space)}."
-            " Must be of type Gym Spaces: Box, Discrete, MultiDiscrete or MultiBinary."
-        )
+    # Copy, so that removing the action limiting entries does not modify the caller's dict
+    dist_kwargs = {} if dist_kwargs is None else dict(dist_kwargs)
+
+    # Walk the MRO so that subclasses of the gym spaces are supported too
+    for space_type in type(action_space).__mro__:
+        make_distribution = _DISTRIBUTION_MAKERS.get(space_type)
+        if make_distribution is not None:
+            return make_distribution(action_space, use_sde, dist_kwargs)
+    raise NotImplementedError(
+        "Error: probability distribution, not implemented for action space"
+        f"of type {type(action_space)}."
+        " Must be of type Gym Spaces: Box, Discrete, MultiDiscrete or MultiBinary."
+    )
 
 
 def kl_divergence(dist_true: Distribution, dist_pred: Distribution) -> th.Tensor:
@@ -1029,12 +1136,9 @@ def kl_divergence(dist_true: Distribution, dist_pred: Distribution) -> th.Tensor
         assert np.allclose(
             dist_pred.action_dims, dist_true.action_dims
         ), "Error: distributions must have the same input space"
-        return th.stack(
-            [
-                th.distributions.kl_divergence(p, q)
-                for p, q in zip(dist_true.distribution, dist_pred.distribution)
-            ],
-            dim=1,
+        # One KL divergence per sub-space, the padded logits do not contribute
+        return th.distributions.kl_divergence(
+            dist_true.distribution, dist_pred.distribution
         ).sum(dim=1)
 
     # Use the PyTorch kl_divergence implementation
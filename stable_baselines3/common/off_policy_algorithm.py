@@ -562,8 +562,10 @@ class OffPolicyAlgorithm(BaseAlgorithm):
         if action_noise is not None and env.num_envs > 1 and not isinstance(action_noise, VectorizedActionNoise):
             action_noise = VectorizedActionNoise(action_noise, env.num_envs)
 
+        # No gradient is needed for the noise used to collect rollouts
         if self.use_sde:
-            self.actor.reset_noise(env.num_envs)
+            with th.no_grad():
+                self.actor.reset_noise(env.num_envs)
 
         callback.on_rollout_start()
         continue_training = True
@@ -571,7 +573,8 @@ class OffPolicyAlgorithm(BaseAlgorithm):
         while should_collect_more_steps(train_freq, num_collected_steps, num_collected_episodes):
             if self.use_sde and self.sde_sample_freq > 0 and num_collected_steps % self.sde_sample_freq == 0:
                 # Sample a new noise matrix
-                self.actor.reset_noise(env.num_envs)
+                with th.no_grad():
+                    self.actor.reset_noise(env.num_envs)
 
             # Select action randomly or according to policy
             actions, buffer_actions = self._sample_action(learning_starts, action_noise, env.num_envs)
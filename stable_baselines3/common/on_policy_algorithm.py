@@ -155,8 +155,10 @@ class OnPolicyAlgorithm(BaseAlgorithm):
         n_steps = 0
         rollout_buffer.reset()
         # Sample new weights for the state dependent exploration
+        # (no gradient is needed to collect rollouts)
         if self.use_sde:
-            self.policy.reset_noise(env.num_envs)
+            with th.no_grad():
+                self.policy.reset_noise(env.num_envs)
 
         callback.on_rollout_start()
 
@@ -167,7 +169,8 @@ class OnPolicyAlgorithm(BaseAlgorithm):
                 and n_steps % self.sde_sample_freq == 0
             ):
                 # Sample a new noise matrix
-                self.policy.reset_noise(env.num_envs)
+                with th.no_grad():
+                    self.policy.reset_noise(env.num_envs)
 
             with th.no_grad():
                 # Convert to pytorch tensor or to TensorDict
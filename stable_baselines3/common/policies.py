@@ -17,6 +17,7 @@ from stable_baselines3.common.distributions import (
     BernoulliDistribution,
     CategoricalDistribution,
     CategoricalDistributionLimitedActions,
+    CategoricalDistributionLimitedActions_Manual,
     DiagGaussianDistribution,
     Distribution,
     MultiCategoricalDistribution,
@@ -452,6 +453,8 @@ class ActorCriticPolicy(BasePolicy):
         ``th.optim.Adam`` by default
     :param optimizer_kwargs: Additional keyword arguments,
         excluding the learning rate, to pass to the optimizer
+    :param use_bf16: Whether to sample the gSDE exploration matrices
+        and compute the noise and the variance in bfloat16.
     """
 
     def __init__(
@@ -474,6 +477,7 @@ class ActorCriticPolicy(BasePolicy):
         optimizer_class: Type[th.optim.Optimizer] = th.optim.Adam,
         optimizer_kwargs: Optional[Dict[str, Any]] = None,
         dist_kwargs: Optional[Dict[str, Any]] = None,
+        use_bf16: bool = False,
     ):
         print("In actorcriticpolicy constructor")
 
@@ -521,6 +525,7 @@ class ActorCriticPolicy(BasePolicy):
                 "squash_output": squash_output,
                 "use_expln": use_expln,
                 "learn_features": False,
+                "use_bf16": use_bf16,
             }
 
         if sde_net_arch is not None:
@@ -556,6 +561,7 @@ class ActorCriticPolicy(BasePolicy):
                 squash_output=default_none_kwargs["squash_output"],
                 full_std=default_none_kwargs["full_std"],
                 use_expln=default_none_kwargs["use_expln"],
+                use_bf16=default_none_kwargs["use_bf16"],
                 lr_schedule=self._dummy_schedule,  # dummy lr schedule, not needed for loading policy alone
                 ortho_init=self.ortho_init,
                 optimizer_class=self.optimizer_class,
@@ -618,6 +624,7 @@ class ActorCriticPolicy(BasePolicy):
             (
                 CategoricalDistribution,
                 CategoricalDistributionLimitedActions,
+                CategoricalDistributionLimitedActions_Manual,
                 MultiCategoricalDistribution,
                 BernoulliDistribution,
             ),
@@ -696,7 +703,13 @@ class ActorCriticPolicy(BasePolicy):
 
         if isinstance(self.action_dist, DiagGaussianDistribution):
             return self.action_dist.proba_distribution(mean_actions, self.log_std)
-        elif isinstance(self.action_dist, CategoricalDistributionLimitedActions):
+        elif isinstance(
+            self.action_dist,
+            (
+                CategoricalDistributionLimitedActions,
+                CategoricalDistributionLimitedActions_Manual,
+            ),
+        ):
             # Here mean_actions are the logits before the softmax
             return self.action_dist.proba_distribution(
                 action_logits=mean_actions, obs=obs
@@ -810,6 +823,8 @@ class ActorCriticCnnPolicy(ActorCriticPolicy):
         ``th.optim.Adam`` by default
     :param optimizer_kwargs: Additional keyword arguments,
         excluding the learning rate, to pass to the optimizer
+    :param use_bf16: Whether to sample the gSDE exploration matrices
+        and compute the noise and the variance in bfloat16.
     """
 
     def __init__(
@@ -831,6 +846,7 @@ class ActorCriticCnnPolicy(ActorCriticPolicy):
         normalize_images: bool = True,
         optimizer_class: Type[th.optim.Optimizer] = th.optim.Adam,
         optimizer_kwargs: Optional[Dict[str, Any]] = None,
+        use_bf16: bool = False,
     ):
         super().__init__(
             observation_space,
@@ -850,6 +866,7 @@ class ActorCriticCnnPolicy(ActorCriticPolicy):
             normalize_images,
             optimizer_class,
             optimizer_kwargs,
+            use_bf16=use_bf16,
         )
 
 
@@ -885,6 +902,8 @@ class MultiInputActorCriticPolicy(ActorCriticPolicy):
         ``th.optim.Adam`` by default
     :param optimizer_kwargs: Additional keyword arguments,
         excluding the learning rate, to pass to the optimizer
+    :param use_bf16: Whether to sample the gSDE exploration matrices
+        and compute the noise and the variance in bfloat16.
     """
 
     def __init__(
@@ -906,6 +925,7 @@ class MultiInputActorCriticPolicy(ActorCriticPolicy):
         normalize_images: bool = True,
         optimizer_class: Type[th.optim.Optimizer] = th.optim.Adam,
         optimizer_kwargs: Optional[Dict[str, Any]] = None,
+        use_bf16: bool = False,
     ):
         super().__init__(
             observation_space,
@@ -925,6 +945,7 @@ class MultiInputActorCriticPolicy(ActorCriticPolicy):
             normalize_images,
             optimizer_class,
             optimizer_kwargs,
+            use_bf16=use_bf16,
         )
 
 
@@ -47,6 +47,8 @@ class Actor(BasePolicy):
     :param clip_mean: Clip the mean output when using gSDE to avoid numerical instability.
     :param normalize_images: Whether to normalize images or not,
          dividing by 255.0 (True by default)
+    :param use_bf16: Whether to sample the gSDE exploration matrices
+        and compute the noise and the variance in bfloat16.
     """
 
     def __init__(
@@ -64,6 +66,7 @@ class Actor(BasePolicy):
         use_expln: bool = False,
         clip_mean: float = 2.0,
         normalize_images: bool = True,
+        use_bf16: bool = False,
     ):
         super().__init__(
             observation_space,
@@ -84,6 +87,7 @@ class Actor(BasePolicy):
         self.use_expln = use_expln
         self.full_std = full_std
         self.clip_mean = clip_mean
+        self.use_bf16 = use_bf16
 
         if sde_net_arch is not None:
             warnings.warn("sde_net_arch is deprecated and will be removed in SB3 v2.4.0.", DeprecationWarning)
@@ -95,7 +99,12 @@ class Actor(BasePolicy):
 
         if self.use_sde:
             self.action_dist = StateDependentNoiseDistribution(
-                action_dim, full_std=full_std, use_expln=use_expln, learn_features=True, squash_output=True
+                action_dim,
+                full_std=full_std,
+                use_expln=use_expln,
+                learn_features=True,
+                squash_output=True,
+                use_bf16=use_bf16,
             )
             self.mu, self.log_std = self.action_dist.proba_distribution_net(
                 latent_dim=last_layer_dim, latent_sde_dim=last_layer_dim, log_std_init=log_std_init
@@ -123,6 +132,7 @@ class Actor(BasePolicy):
                 use_expln=self.use_expln,
                 features_extractor=self.features_extractor,
                 clip_mean=self.clip_mean,
+                use_bf16=self.use_bf16,
             )
         )
         return data
@@ -215,6 +225,8 @@ class SACPolicy(BasePolicy):
     :param n_critics: Number of critic networks to create.
     :param share_features_extractor: Whether to share or not the features extractor
         between the actor and the critic (this saves computation time)
+    :param use_bf16: Whether to sample the gSDE exploration matrices
+        and compute the noise and the variance in bfloat16.
     """
 
     def __init__(
@@ -236,6 +248,7 @@ class SACPolicy(BasePolicy):
         optimizer_kwargs: Optional[Dict[str, Any]] = None,
         n_critics: int = 2,
         share_features_extractor: bool = False,
+        use_bf16: bool = False,
     ):
         super().__init__(
             observation_space,
@@ -271,6 +284,7 @@ class SACPolicy(BasePolicy):
             "log_std_init": log_std_init,
             "use_expln": use_expln,
             "clip_mean": clip_mean,
+            "use_bf16": use_bf16,
         }
         self.actor_kwargs.update(sde_kwargs)
         self.critic_kwargs = self.net_args.copy()
@@ -323,6 +337,7 @@ class SACPolicy(BasePolicy):
                 log_std_init=self.actor_kwargs["log_std_init"],
                 use_expln=self.actor_kwargs["use_expln"],
                 clip_mean=self.actor_kwargs["clip_mean"],
+                use_bf16=self.actor_kwargs["use_bf16"],
                 n_critics=self.critic_kwargs["n_critics"],
                 lr_schedule=self._dummy_schedule,  # dummy lr schedule, not needed for loading policy alone
                 optimizer_class=self.optimizer_class,
@@ -399,6 +414,8 @@ class CnnPolicy(SACPolicy):
     :param n_critics: Number of critic networks to create.
     :param share_features_extractor: Whether to share or not the features extractor
         between the actor and the critic (this saves computation time)
+    :param use_bf16: Whether to sample the gSDE exploration matrices
+        and compute the noise and the variance in bfloat16.
     """
 
     def __init__(
@@ -420,6 +437,7 @@ class CnnPolicy(SACPolicy):
         optimizer_kwargs: Optional[Dict[str, Any]] = None,
         n_critics: int = 2,
         share_features_extractor: bool = False,
+        use_bf16: bool = False,
     ):
         super().__init__(
             observation_space,
@@ -439,6 +457,7 @@ class CnnPolicy(SACPolicy):
             optimizer_kwargs,
             n_critics,
             share_features_extractor,
+            use_bf16,
         )
 
 
@@ -470,6 +489,8 @@ class MultiInputPolicy(SACPolicy):
     :param n_critics: Number of critic networks to create.
     :param share_features_extractor: Whether to share or not the features extractor
         between the actor and the critic (this saves computation time)
+    :param use_bf16: Whether to sample the gSDE exploration matrices
+        and compute the noise and the variance in bfloat16.
     """
 
     def __init__(
@@ -491,6 +512,7 @@ class MultiInputPolicy(SACPolicy):
         optimizer_kwargs: Optional[Dict[str, Any]] = None,
         n_critics: int = 2,
         share_features_extractor: bool = False,
+        use_bf16: bool = False,
     ):
         super().__init__(
             observation_space,
@@ -510,4 +532,5 @@ class MultiInputPolicy(SACPolicy):
             optimizer_kwargs,
             n_critics,
             share_features_extractor,
+            use_bf16,
         )
@@ -10,12 +10,16 @@ from stable_baselines3 import A2C, PPO
 from stable_baselines3.common.distributions import (
     BernoulliDistribution,
     CategoricalDistribution,
+    CategoricalDistributionLimitedActions,
+    CategoricalDistributionLimitedActions_Manual,
     DiagGaussianDistribution,
     MultiCategoricalDistribution,
     SquashedDiagGaussianDistribution,
     StateDependentNoiseDistribution,
     TanhBijector,
+    categorical_entropy,
     kl_divergence,
+    make_proba_distribution,
 )
 from stable_baselines3.common.utils import set_random_seed
 
@@ -36,6 +40,12 @@ def test_bijector():
     assert th.max(th.abs(squashed_actions)) <= 1.0
     # Check the inverse method
     assert th.isclose(TanhBijector.inverse(squashed_actions), actions).all()
+    # Check the squash correction against its direct form
+    gaussian_actions = th.linspace(-3.0, 3.0, 7)
+    expected = th.log(1.0 - th.tanh(gaussian_actions) ** 2)
+    assert th.allclose(bijector.log_prob_correction(gaussian_actions), expected, atol=1e-5)
+    # and that it stays finite when 1 - tanh(x)^2 underflows
+    assert th.isfinite(bijector.log_prob_correction(th.tensor([-50.0, 50.0]))).all()
 
 
 @pytest.mark.parametrize("model_class", [A2C, PPO])
@@ -54,6 +64,42 @@ def test_squashed_gaussian(model_class):
     assert th.max(th.abs(actions)) <= 1.0
 
 
+def test_squashed_gaussian_log_prob():
+    set_random_seed(1)
+    dist = SquashedDiagGaussianDistribution(N_ACTIONS)
+    dist = dist.proba_distribution(th.rand(10, N_ACTIONS), th.rand(N_ACTIONS))
+    gaussian_actions = th.randn(10, N_ACTIONS)
+    actions = th.tanh(gaussian_actions)
+    # Direct form of the change of variable formula
+    expected = dist.distribution.log_prob(gaussian_actions).sum(dim=1) - th.log(1 - actions**2).sum(dim=1)
+    assert th.allclose(dist.log_prob(actions, gaussian_actions), expected, atol=1e-5)
+    assert th.allclose(dist.log_prob(actions), expected, atol=1e-3)
+
+
+@pytest.mark.parametrize("log_std_init", [-2.0, 2.0])
+def test_sde_squashed_log_prob(log_std_init):
+    # With log_std_init=2.0, most of the actions are saturated by the tanh
+    set_random_seed(1)
+    dist = StateDependentNoiseDistribution(N_ACTIONS, squash_output=True)
+    _, log_std = dist.proba_distribution_net(N_FEATURES, log_std_init=log_std_init)
+    dist.sample_weights(log_std, batch_size=10)
+    mean_actions, latent_sde = th.rand(10, N_ACTIONS), 2 * th.rand(10, N_FEATURES) - 1
+
+    # The sampled actions go through the tanh inverse, like the actions stored in a buffer,
+    # so that the log likelihood is the same during the rollout and the update
+    actions = dist.proba_distribution(mean_actions, log_std, latent_sde).sample()
+    assert th.allclose(dist.log_prob(actions), dist.log_prob(actions.clone()))
+
+    # log_prob_from_params() reuses the actions before squashing
+    actions, log_prob = dist.log_prob_from_params(mean_actions, log_std, latent_sde)
+    gaussian_actions = dist.gaussian_actions
+    assert th.allclose(th.tanh(gaussian_actions), actions)
+    # Direct form of the change of variable formula, in double precision
+    gaussian_actions = gaussian_actions.double()
+    expected = dist.distribution.log_prob(gaussian_actions) - th.log(1 - th.tanh(gaussian_actions) ** 2)
+    assert th.allclose(log_prob.double(), expected.sum(dim=1), rtol=1e-4)
+
+
 @pytest.fixture()
 def dummy_model_distribution_obs_and_actions() -> Tuple[A2C, np.array, np.array]:
     """
@@ -92,11 +138,12 @@ def test_predict_values(dummy_model_distribution_obs_and_actions):
         assert th.allclose(values_1, values_2)
 
 
-def test_sde_distribution():
+@pytest.mark.parametrize("use_bf16", [False, True])
+def test_sde_distribution(use_bf16):
     n_actions = 1
     deterministic_actions = th.ones(N_SAMPLES, n_actions) * 0.1
     state = th.ones(N_SAMPLES, N_FEATURES) * 0.3
-    dist = StateDependentNoiseDistribution(n_actions, full_std=True, squash_output=False)
+    dist = StateDependentNoiseDistribution(n_actions, full_std=True, squash_output=False, use_bf16=use_bf16)
 
     set_random_seed(1)
     _, log_std = dist.proba_distribution_net(N_FEATURES)
@@ -105,8 +152,44 @@ def test_sde_distribution():
     dist = dist.proba_distribution(deterministic_actions, log_std, state)
     actions = dist.get_actions()
 
-    assert th.allclose(actions.mean(), dist.distribution.mean.mean(), rtol=2e-3)
-    assert th.allclose(actions.std(), dist.distribution.scale.mean(), rtol=2e-3)
+    # bfloat16 only has about 3 significant digits
+    rtol = 1e-2 if use_bf16 else 2e-3
+    assert th.allclose(actions.mean(), dist.distribution.mean.mean(), rtol=rtol)
+    assert th.allclose(actions.std(), dist.distribution.scale.mean(), rtol=rtol)
+
+
+@pytest.mark.parametrize("full_std", [True, False])
+def test_sde_exploration_matrices_contiguous(full_std):
+    # The std is an expanded view when full_std=False,
+    # the noise matrices multiplied in get_noise() must still be dense
+    dist = StateDependentNoiseDistribution(N_ACTIONS, full_std=full_std)
+    _, log_std = dist.proba_distribution_net(N_FEATURES)
+    for grad_enabled in [True, False]:
+        with th.set_grad_enabled(grad_enabled):
+            dist.sample_weights(log_std, batch_size=4)
+        assert dist.exploration_mat.is_contiguous()
+        assert dist.exploration_matrices.is_contiguous()
+
+
+@pytest.mark.parametrize("use_sde", [False, True])
+def test_std_follows_data_updates(use_sde):
+    # Parameters are sometimes overwritten through .data (e.g. by a line search),
+    # which does not bump their version counter
+    mean_actions = th.zeros(N_SAMPLES // 1000, N_ACTIONS)
+    latent_sde = th.ones(N_SAMPLES // 1000, N_FEATURES)
+    if use_sde:
+        dist = StateDependentNoiseDistribution(N_ACTIONS, full_std=True)
+    else:
+        dist = DiagGaussianDistribution(N_ACTIONS)
+    _, log_std = dist.proba_distribution_net(N_FEATURES)
+    args = (latent_sde,) if use_sde else ()
+
+    with th.no_grad():
+        dist.proba_distribution(mean_actions, log_std, *args)
+        old_scale = dist.distribution.scale.clone()
+        log_std.data.add_(1.0)
+        dist.proba_distribution(mean_actions, log_std, *args)
+    assert th.allclose(dist.distribution.scale, old_scale * np.exp(1.0), rtol=1e-4)
 
 
 # TODO: analytical form for squashed Gaussian?
@@ -135,6 +218,9 @@ def test_entropy(dist):
     entropy = dist.entropy()
     log_prob = dist.log_prob(actions)
     assert th.allclose(entropy.mean(), -log_prob.mean(), rtol=5e-3)
+    # One independent entry per sample
+    assert entropy.shape == (N_SAMPLES,)
+    entropy.add_(1.0)
 
 
 categorical_params = [
@@ -157,6 +243,109 @@ def test_categorical(dist, CAT_ACTIONS):
     assert th.allclose(entropy.mean(), -log_prob.mean(), rtol=5e-3)
 
 
+def test_categorical_limited_actions():
+    set_random_seed(1)
+    n_batch = 64
+    # Observations directly encode the invalid actions
+    obs = th.randint(0, 2, (n_batch, N_ACTIONS + 1)).float()
+    obs[:, 0] = 0.0
+
+    dist = CategoricalDistributionLimitedActions(N_ACTIONS + 1, th.nn.Identity)
+    action_logits = th.rand(n_batch, N_ACTIONS + 1, requires_grad=True)
+    dist = dist.proba_distribution(action_logits, obs)
+    actions = dist.get_actions()
+    # Only valid actions are sampled
+    assert (obs.gather(1, actions.unsqueeze(1)) == 0.0).all()
+    assert (obs.gather(1, dist.mode().unsqueeze(1)) == 0.0).all()
+    # The logits of the invalid actions are pushed below the smallest logit
+    assert (dist.distribution.probs[obs > 0] < 1e-4).all()
+    dist.log_prob(actions).sum().backward()
+    assert action_logits.grad is not None
+
+
+def test_categorical_limited_actions_manual():
+    set_random_seed(1)
+    n_batch = 64
+    obs = th.randint(0, 2, (n_batch, N_ACTIONS + 1)).float()
+    obs[:, 0] = 1.0
+
+    def get_valid_actions(batch_obs):
+        # Called once on the whole batch, one row of valid actions per observation
+        return batch_obs
+
+    dist = CategoricalDistributionLimitedActions_Manual(N_ACTIONS + 1, get_valid_actions)
+    action_logits = th.rand(n_batch, N_ACTIONS + 1)
+    dist = dist.proba_distribution(action_logits, obs)
+    actions = dist.get_actions()
+    assert actions.shape == (n_batch,)
+    # Only valid actions are sampled
+    assert (obs.gather(1, actions.unsqueeze(1)) == 1.0).all()
+    assert (obs.gather(1, dist.mode().unsqueeze(1)) == 1.0).all()
+
+    def get_valid_actions_single(single_obs):
+        # Only handles one observation, vectorized by the distribution
+        assert single_obs.shape == (N_ACTIONS + 1,)
+        return single_obs
+
+    dist = CategoricalDistributionLimitedActions_Manual(N_ACTIONS + 1, get_valid_actions_single, vectorize_valid_actions=True)
+    actions = dist.proba_distribution(action_logits, obs).get_actions()
+    assert (obs.gather(1, actions.unsqueeze(1)) == 1.0).all()
+
+
+def test_make_limited_actions_distribution():
+    def get_valid_actions(batch_obs):
+        return batch_obs
+
+    dist_kwargs = {"get_valid_actions": get_valid_actions}
+    dist = make_proba_distribution(gym.spaces.Discrete(N_ACTIONS), dist_kwargs=dist_kwargs)
+    assert isinstance(dist, CategoricalDistributionLimitedActions_Manual)
+    # The caller's kwargs are left untouched
+    assert dist_kwargs == {"get_valid_actions": get_valid_actions}
+
+    def only_first_action(batch_obs):
+        # CartPole observations, only the first of the two actions is valid
+        valid_actions = th.zeros(batch_obs.shape[0], 2)
+        valid_actions[:, 0] = 1.0
+        return valid_actions
+
+    model = PPO(
+        "MlpPolicy",
+        "CartPole-v1",
+        n_steps=64,
+        batch_size=32,
+        n_epochs=1,
+        policy_kwargs=dict(dist_kwargs={"get_valid_actions": only_first_action}),
+    )
+    assert isinstance(model.policy.action_dist, CategoricalDistributionLimitedActions_Manual)
+    model.learn(64)
+    assert (model.rollout_buffer.actions == 0).all()
+    obs = model.env.reset()
+    for _ in range(10):
+        action, _ = model.predict(obs)
+        assert (action == 0).all()
+        obs, _, _, _ = model.env.step(action)
+
+
+def test_multicategorical_padding():
+    # Sub-spaces of different sizes share a single padded distribution
+    action_dims = [2, 5, 1]
+    dist = MultiCategoricalDistribution(action_dims)
+    dist = dist.proba_distribution(th.rand(1000, sum(action_dims)) * 10)
+    for actions in [dist.sample(), dist.mode()]:
+        assert actions.shape == (1000, len(action_dims))
+        # The padded logits are never selected
+        assert (actions < th.tensor(action_dims)).all()
+    assert th.isfinite(dist.log_prob(dist.sample())).all()
+
+
+def test_categorical_entropy_chunks():
+    action_logits = th.rand(100, 3, 7)
+    expected = th.distributions.Categorical(logits=action_logits).entropy()
+    assert th.allclose(categorical_entropy(action_logits), expected)
+    # Smaller chunks than the batch size
+    assert th.allclose(categorical_entropy(action_logits, max_chunk_numel=50), expected)
+
+
 @pytest.mark.parametrize(
     "dist_type",
     [
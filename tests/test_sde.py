@@ -77,3 +77,19 @@ def test_state_dependent_noise(model_class, use_expln):
     model.policy.reset_noise()
     if model_class == SAC:
         model.policy.actor.get_std()
+
+
+@pytest.mark.parametrize("model_class", [SAC, PPO])
+def test_state_dependent_noise_bf16(model_class):
+    kwargs = {"learning_starts": 0} if model_class == SAC else {"n_steps": 64}
+    model = model_class(
+        "MlpPolicy",
+        "Pendulum-v1",
+        use_sde=True,
+        policy_kwargs=dict(log_std_init=-2, net_arch=[64], use_bf16=True),
+        **kwargs,
+    )
+    model.learn(total_timesteps=128)
+    action_dist = model.policy.actor.action_dist if model_class == SAC else model.policy.action_dist
+    assert action_dist.use_bf16
+    assert action_dist.exploration_mat.dtype == th.bfloat16